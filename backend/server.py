@@ -1,15 +1,37 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Query
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, GEOSPHERE, UpdateOne
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, create_model
+from typing import Any, Dict, List, Optional
 import uuid
 from datetime import datetime, timezone
 import json
+import csv
+import io
+import asyncio
+import anyio
+import functools
+import inspect
+import zlib
+from urllib.parse import parse_qsl
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+import numpy as np
+import orjson
+import re
+
+try:
+    import msgpack
+except ImportError:  # msgpack responses are optional; JSON is always available
+    msgpack = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -18,7 +40,44 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
-app = FastAPI()
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+_wants_msgpack = ContextVar("wants_msgpack", default=False)
+
+
+class APIResponse(ORJSONResponse):
+    """orjson by default; msgpack when the client sent `Accept: application/msgpack`."""
+
+    def __init__(self, content=None, *args, **kwargs):
+        if msgpack is not None and _wants_msgpack.get():
+            self.media_type = MSGPACK_MEDIA_TYPE
+        super().__init__(content, *args, **kwargs)
+        self.headers.add_vary_header("Accept")
+
+    def render(self, content):
+        if self.media_type != MSGPACK_MEDIA_TYPE:
+            return super().render(content)
+        # Content is already JSON-safe here (safe_float stores NaN as None); floats pack as float64
+        return msgpack.packb(content, use_bin_type=True)
+
+
+class ContentNegotiationMiddleware:
+    """Pure ASGI middleware that records the Accept preference for APIResponse."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = dict(scope["headers"]).get(b"accept", b"").decode("latin-1")
+        token = _wants_msgpack.set(MSGPACK_MEDIA_TYPE in accept)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _wants_msgpack.reset(token)
+
+
+app = FastAPI(default_response_class=APIResponse)
 api_router = APIRouter(prefix="/api")
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -34,6 +93,13 @@ class ChatResponse(BaseModel):
     reply: str
     session_id: str
 
+class BatchItem(BaseModel):
+    route: str
+    params: Dict[str, Any] = Field(default_factory=dict)
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
+
 
 def safe_float(v):
     if v is None:
@@ -54,6 +120,495 @@ def safe_int(v):
         return None
 
 
+# Column order and storage type of every erw_samples field (used by export)
+SAMPLE_FIELDS = {
+    "id": "str", "feedstock": "str", "omega_threshold": "int", "sample_no": "str", "river_type": "str",
+    "latitude": "float", "longitude": "float", "ph": "float", "alkalinity": "float", "temp_c": "float",
+    "ca": "float", "mg": "float", "na": "float", "k": "float", "cl": "float", "so4": "float",
+    "no3": "float", "salinity": "float", "ksp": "float", "hco3": "float", "co3": "float",
+    "co2_aq": "float", "dic": "float", "pco2": "float", "fco2": "float", "z_plus": "float",
+    "z_minus": "float", "nicb": "float", "omega_calcite": "float", "si_calcite": "float",
+    "state": "str", "region": "str", "river_name": "str", "discharge": "float", "source": "str",
+    "j_steps": "int", "k_steps": "int", "rock_addition": "float", "omega_flag": "int",
+    "success_flag": "int", "omega_final": "float", "ca_final": "float", "alk_final": "float",
+    "dic_final": "float", "ph_final": "float", "pco2_final": "float", "discharge_ms": "float",
+    "cdr_mol_s": "float", "cdr_t_yr": "float", "cdr_kt_yr": "float", "nicb_tier": "int",
+}
+
+
+# ── Charge-balance quality ──
+# nicb_tier: 1 = |NICB| <= 5 %, 2 = <= 10 %, 3 = > 10 %, None = no charge data
+QUALITY_TIERS = {"within_5": 1, "within_10": 2}
+
+
+def nicb_tier(nicb, z_plus, z_minus):
+    if nicb is None:
+        if z_plus is None or z_minus is None or z_plus + z_minus == 0:
+            return None
+        nicb = (z_plus - z_minus) / (z_plus + z_minus) * 100
+    a = abs(nicb)
+    return 1 if a <= 5 else 2 if a <= 10 else 3
+
+
+def quality_max_tier(quality):
+    if not quality or quality == "all":
+        return None
+    if quality not in QUALITY_TIERS:
+        raise HTTPException(status_code=400, detail=f"quality must be one of {['all', *QUALITY_TIERS]}")
+    return QUALITY_TIERS[quality]
+
+
+def sample_match(feedstock, omega, quality=None, **extra):
+    """Base erw_samples filter for a (feedstock, omega) dataset, optionally screened by NICB quality."""
+    query = {"feedstock": feedstock, "omega_threshold": omega, **extra}
+    max_tier = quality_max_tier(quality)
+    if max_tier is not None:
+        query["nicb_tier"] = {"$lte": max_tier}
+    return query
+
+
+def geo_point(lat, lon):
+    """GeoJSON point for the 2dsphere index, or None when coordinates are missing/out of range."""
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+def parse_sample_row(row, feedstock, omega_threshold):
+    sample = {
+        "id": str(uuid.uuid4()), "feedstock": feedstock, "omega_threshold": omega_threshold,
+        "sample_no": str(row[0]) if row[0] else "", "river_type": str(row[1]) if row[1] else "",
+        "latitude": safe_float(row[2]), "longitude": safe_float(row[3]),
+        "ph": safe_float(row[4]), "alkalinity": safe_float(row[5]), "temp_c": safe_float(row[6]),
+        "ca": safe_float(row[7]), "mg": safe_float(row[8]), "na": safe_float(row[9]),
+        "k": safe_float(row[10]), "cl": safe_float(row[11]), "so4": safe_float(row[12]),
+        "no3": safe_float(row[13]), "salinity": safe_float(row[15]), "ksp": safe_float(row[17]),
+        "hco3": safe_float(row[20]), "co3": safe_float(row[21]), "co2_aq": safe_float(row[22]),
+        "dic": safe_float(row[23]), "pco2": safe_float(row[24]), "fco2": safe_float(row[25]),
+        "z_plus": safe_float(row[27]), "z_minus": safe_float(row[28]), "nicb": safe_float(row[29]),
+        "omega_calcite": safe_float(row[31]), "si_calcite": safe_float(row[32]),
+        "state": str(row[34]) if row[34] else "", "region": str(row[35]) if row[35] else "",
+        "river_name": str(row[36]) if row[36] else "", "discharge": safe_float(row[37]),
+        "source": str(row[38]) if row[38] else "",
+        "j_steps": safe_int(row[40]), "k_steps": safe_int(row[41]),
+        "rock_addition": safe_float(row[42]), "omega_flag": safe_int(row[43]),
+        "success_flag": safe_int(row[44]), "omega_final": safe_float(row[47]),
+        "ca_final": safe_float(row[48]), "alk_final": safe_float(row[50]),
+        "dic_final": safe_float(row[51]), "ph_final": safe_float(row[53]),
+        "pco2_final": safe_float(row[55]), "discharge_ms": safe_float(row[57]),
+        "cdr_mol_s": safe_float(row[58]), "cdr_t_yr": safe_float(row[59]),
+        "cdr_kt_yr": safe_float(row[60]),
+    }
+    sample["nicb_tier"] = nicb_tier(sample["nicb"], sample["z_plus"], sample["z_minus"])
+    location = geo_point(sample["latitude"], sample["longitude"])
+    if location:
+        sample["location"] = location
+    return sample
+
+
+# ── Response models ──
+ANALYTICS_FIELDS = (
+    "ph", "alkalinity", "dic", "pco2", "fco2", "temp_c", "rock_addition", "cdr_t_yr", "omega_calcite",
+    "si_calcite", "omega_final", "discharge", "region", "state", "ca", "mg", "na", "k", "hco3", "co3",
+    "co2_aq", "salinity", "z_plus", "z_minus", "nicb", "cl", "so4", "no3", "latitude", "longitude",
+    "river_name", "sample_no",
+)
+MAP_FIELDS = (
+    "latitude", "longitude", "river_name", "state", "region", "cdr_t_yr", "alkalinity", "ph",
+    "rock_addition", "omega_final", "sample_no", "ca", "mg", "hco3", "dic", "si_calcite",
+)
+GEO_FIELDS = MAP_FIELDS + ("river_type",)
+
+
+def sample_model(name, fields, **extra):
+    """Pydantic model over a subset of SAMPLE_FIELDS; every field is optional like the stored documents."""
+    types = {"str": str, "float": float, "int": int}
+    return create_model(name, **{f: (Optional[types[SAMPLE_FIELDS[f]]], None) for f in fields}, **extra)
+
+
+AnalyticsRecord = sample_model("AnalyticsRecord", ANALYTICS_FIELDS)
+MapPoint = sample_model("MapPoint", MAP_FIELDS)
+GeoSample = sample_model("GeoSample", GEO_FIELDS, distance_km=(float, ...))
+Sample = sample_model("Sample", SAMPLE_FIELDS, location=(Optional[Dict[str, Any]], None))
+
+
+class SamplesPage(BaseModel):
+    samples: List[Sample]
+    total: int
+
+class DashboardOverview(BaseModel):
+    total_cdr_t_yr: Optional[float] = 0
+    avg_cdr_t_yr: Optional[float] = 0
+    total_samples: int
+    samples_with_cdr: int
+    avg_ph: Optional[float] = None
+    avg_alkalinity: Optional[float] = None
+    avg_rock_addition: Optional[float] = None
+    avg_omega_final: Optional[float] = None
+    success_rate: float
+    feedstock: str
+    omega_threshold: int
+    quality: str
+
+class BasinStat(BaseModel):
+    basin: str
+    count: int
+    avg_ta: float
+    avg_ca: float
+    avg_mg: float
+    avg_na: float
+    avg_k: float
+    avg_hco3: float
+    avg_dic: float
+    avg_pco2: float
+    avg_co2_aq: float
+    avg_ph: float
+    avg_si_calcite: float
+    avg_omega_calcite: float
+    total_cdr: float
+    avg_cdr: float
+    avg_rock_add: float
+    ca_mg_ratio: float
+
+class NicbQuality(BaseModel):
+    basin: str
+    count: int
+    pct_within_5: float
+    pct_within_10: float
+    pct_beyond_10: float
+
+class SummaryStat(BaseModel):
+    id: str
+    feedstock: str
+    omega_threshold: int
+    region: str
+    add_mean: float
+    add_median: float
+    add_std: float
+    add_min: float
+    add_max: float
+    n_samples: int
+    omega_mean: float
+    omega_median: float
+    omega_std: float
+    cdr_mean: float
+    cdr_total: float
+    n_with_q: int
+    success_pct: float
+    quality: str = "all"
+    version: Optional[int] = None
+
+class RegionCdr(BaseModel):
+    region: str
+    total_cdr: float
+    avg_cdr: float
+    count: int
+    avg_ph: float
+    avg_rock_add: float
+
+class StateCdr(BaseModel):
+    state: str
+    total_cdr: float
+    avg_cdr: float
+    count: int
+
+class TopRiver(BaseModel):
+    river: str
+    total_cdr: float
+    avg_cdr: float
+    count: int
+    region: Optional[str] = ""
+    state: Optional[str] = ""
+
+class ComparisonRegion(BaseModel):
+    region: str
+    total_cdr: float
+    avg_cdr: float
+    avg_rock_add: float
+    count: int
+    success_rate: float
+
+class OmegaComparison(BaseModel):
+    omega_threshold: int
+    total_cdr: float
+    avg_rock_add: float
+    total_samples: int
+    regions: List[ComparisonRegion]
+
+class Interval(BaseModel):
+    estimate: Optional[float] = None
+    lower: Optional[float] = None
+    upper: Optional[float] = None
+
+class BootstrapGroup(BaseModel):
+    group: str
+    count: int
+    total_cdr: Interval
+    mean_cdr: Interval
+    mean_rock_addition: Interval
+
+class BootstrapCI(BaseModel):
+    feedstock: str
+    omega_threshold: int
+    group_by: str
+    quality: str
+    n_boot: int
+    confidence: int
+    version: int
+    groups: List[BootstrapGroup]
+
+class Filters(BaseModel):
+    regions: List[str]
+    states: List[str]
+
+class FacetBucket(BaseModel):
+    value: str
+    count: int
+    total_cdr: float
+
+class FacetTotal(BaseModel):
+    count: int
+    total_cdr: float
+
+class Facets(BaseModel):
+    facets: Dict[str, List[FacetBucket]]
+    total: FacetTotal
+    selection: Dict[str, str]
+    version: int
+    feedstock: str
+    omega_threshold: int
+    quality: str
+
+class Feedstock(BaseModel):
+    id: Optional[str] = None
+    name: str
+    omega_thresholds: List[int] = []
+    created_at: Optional[str] = None
+    sample_count: int = 0
+
+class UploadResult(BaseModel):
+    message: str
+    samples_count: int
+
+class SingleFlightMetrics(BaseModel):
+    leaders: int
+    coalesced: int
+    timeouts: int
+    errors: int
+    in_flight: int
+    timeout_s: float
+
+class ChatMessage(BaseModel):
+    session_id: str
+    role: str
+    content: str
+    timestamp: str
+
+class BatchResult(BaseModel):
+    route: str
+    status: int
+    data: Any = None
+    error: Any = None
+
+class BatchResponse(BaseModel):
+    results: List[BatchResult]
+
+
+# ── Indexes ──
+async def ensure_indexes():
+    # Backfill quality tiers, then index them so screened views cost the same as unscreened ones
+    missing = db.erw_samples.find({"nicb_tier": {"$exists": False}}, {"_id": 1, "nicb": 1, "z_plus": 1, "z_minus": 1})
+    updates = [UpdateOne({"_id": doc["_id"]}, {"$set": {"nicb_tier": nicb_tier(doc.get("nicb"), doc.get("z_plus"), doc.get("z_minus"))}})
+               async for doc in missing]
+    if updates:
+        await db.erw_samples.bulk_write(updates, ordered=False)
+        logger.info(f"Backfilled nicb_tier on {len(updates)} samples")
+    await db.erw_samples.create_index([("feedstock", ASCENDING), ("omega_threshold", ASCENDING), ("nicb_tier", ASCENDING)])
+    await db.summary_stats.create_index([("feedstock", ASCENDING), ("omega_threshold", ASCENDING), ("quality", ASCENDING)])
+    # Backfill GeoJSON points for samples stored before `location` existed
+    missing = db.erw_samples.find({"location": {"$exists": False}, "latitude": {"$ne": None}, "longitude": {"$ne": None}},
+                                  {"_id": 1, "latitude": 1, "longitude": 1})
+    updates = []
+    async for doc in missing:
+        location = geo_point(doc["latitude"], doc["longitude"])
+        if location:
+            updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"location": location}}))
+    if updates:
+        await db.erw_samples.bulk_write(updates, ordered=False)
+        logger.info(f"Backfilled location on {len(updates)} samples")
+    await db.erw_samples.create_index([("location", GEOSPHERE)])
+
+
+# ── Dataset versions ──
+# Bumped on every ingest so derived indexes/caches know when to rebuild
+async def bump_dataset_version(feedstock, omega):
+    await db.dataset_versions.update_one(
+        {"feedstock": feedstock, "omega_threshold": omega},
+        {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True,
+    )
+
+
+async def get_dataset_version(feedstock, omega):
+    doc = await db.dataset_versions.find_one({"feedstock": feedstock, "omega_threshold": omega}, {"_id": 0, "version": 1})
+    return doc["version"] if doc else 0
+
+
+# ── Single-flight ──
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight task instead of each querying Mongo."""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._inflight = {}
+        self.stats = {"leaders": 0, "coalesced": 0, "timeouts": 0, "errors": 0}
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Retrieve the exception so it is not logged as unhandled when every waiter has gone
+        if not task.cancelled() and task.exception() is not None:
+            if isinstance(task.exception(), asyncio.TimeoutError):
+                self.stats["timeouts"] += 1
+            else:
+                self.stats["errors"] += 1
+
+    async def run(self, key, factory):
+        task = self._inflight.get(key)
+        if task is None:
+            # The shared task carries the timeout itself: a hung query is cancelled and its key freed,
+            # so the next caller starts a fresh query instead of coalescing onto the stuck one
+            task = asyncio.ensure_future(asyncio.wait_for(factory(), self.timeout))
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._done, key))
+            self.stats["leaders"] += 1
+        else:
+            self.stats["coalesced"] += 1
+        try:
+            # shield: a cancelled caller must not cancel the query other waiters share
+            return await asyncio.shield(task)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Aggregation timed out")
+
+    def metrics(self):
+        return {**self.stats, "in_flight": len(self._inflight), "timeout_s": self.timeout}
+
+
+single_flight = SingleFlight(timeout=float(os.environ.get("SINGLE_FLIGHT_TIMEOUT", "30")))
+
+
+def coalesced(fn):
+    """Route decorator: identical concurrent calls (after applying defaults) share one execution."""
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (fn.__name__, tuple(sorted(bound.arguments.items())))
+        return await single_flight.run(key, lambda: fn(*bound.args, **bound.kwargs))
+    return wrapper
+
+
+# ── Summary statistics ──
+SUMMARY_COLUMNS = ("region", "rock_addition", "omega_final", "cdr_t_yr", "discharge", "success_flag")
+SUMMARY_TOTAL_REGION = "TOTAL / OVERALL"
+
+
+def _describe(values):
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return 0.0, 0.0, 0.0, 0.0, 0.0
+    std = values.std(ddof=1) if len(values) > 1 else 0.0
+    return float(values.mean()), float(np.median(values)), float(std), float(values.min()), float(values.max())
+
+
+def _summary_row(region, numeric, sl):
+    n = len(numeric["cdr_t_yr"][sl])
+    add_mean, add_median, add_std, add_min, add_max = _describe(numeric["rock_addition"][sl])
+    omega_mean, omega_median, omega_std, _, _ = _describe(numeric["omega_final"][sl])
+    cdr = numeric["cdr_t_yr"][sl]
+    return {
+        "region": region, "add_mean": add_mean, "add_median": add_median, "add_std": add_std,
+        "add_min": add_min, "add_max": add_max, "n_samples": int(n),
+        "omega_mean": omega_mean, "omega_median": omega_median, "omega_std": omega_std,
+        "cdr_mean": float(np.nanmean(cdr)) if (~np.isnan(cdr)).any() else 0.0,
+        "cdr_total": float(np.nansum(cdr)),
+        "n_with_q": int((~np.isnan(numeric["discharge"][sl])).sum()),
+        "success_pct": float((numeric["success_flag"][sl] == 1).sum() / n * 100) if n else 0.0,
+    }
+
+
+def compute_summary_stats(columns):
+    """Per-region stats from column arrays: one argsort, then each region is a contiguous slice.
+
+    A final TOTAL / OVERALL row covers every sample, as in the workbook's summary sheet.
+    """
+    regions = np.array([r or "" for r in columns["region"]], dtype=str)
+    if len(regions) == 0:
+        return []
+    order = np.argsort(regions, kind="stable")
+    regions = regions[order]
+    numeric = {f: np.array(columns[f], dtype=float)[order] for f in SUMMARY_COLUMNS[1:]}
+    names, starts = np.unique(regions, return_index=True)
+    bounds = list(starts) + [len(regions)]
+    stats = [_summary_row(str(name), numeric, slice(bounds[i], bounds[i + 1]))
+             for i, name in enumerate(names) if name]
+    stats.append(_summary_row(SUMMARY_TOTAL_REGION, numeric, slice(None)))
+    return stats
+
+
+def compute_screened_summaries(columns, tiers):
+    """Summary rows for every quality level; `tiers` holds each sample's nicb_tier."""
+    rows = [{**st, "quality": "all"} for st in compute_summary_stats(columns)]
+    for quality, max_tier in QUALITY_TIERS.items():
+        keep = [i for i, t in enumerate(tiers) if t is not None and t <= max_tier]
+        screened = {f: [values[i] for i in keep] for f, values in columns.items()}
+        rows += [{**st, "quality": quality} for st in compute_summary_stats(screened)]
+    return rows
+
+
+async def refresh_summary_stats(feedstock, omega):
+    """Recompute summary_stats for one dataset (one set per quality level) from the samples actually stored."""
+    version = await get_dataset_version(feedstock, omega)
+    columns = {f: [] for f in SUMMARY_COLUMNS}
+    tiers = []
+    cursor = db.erw_samples.find({"feedstock": feedstock, "omega_threshold": omega},
+                                 {"_id": 0, "nicb_tier": 1, **{f: 1 for f in SUMMARY_COLUMNS}})
+    async for doc in cursor:
+        for f in SUMMARY_COLUMNS:
+            columns[f].append(doc.get(f))
+        tiers.append(doc.get("nicb_tier"))
+    stats = await asyncio.get_running_loop().run_in_executor(None, compute_screened_summaries, columns, tiers)
+    await db.summary_stats.delete_many({"feedstock": feedstock, "omega_threshold": omega})
+    if stats:
+        await db.summary_stats.insert_many([
+            {"id": str(uuid.uuid4()), "feedstock": feedstock, "omega_threshold": omega, "version": version, **st}
+            for st in stats
+        ])
+    logger.info(f"Refreshed {len(stats)} summary stats for {feedstock}/omega {omega} (version {version})")
+
+
+async def refresh_stale_summaries():
+    """Regenerate summaries that are missing, predate the overall row or quality sets, or are from an older version."""
+    datasets = await db.erw_samples.aggregate([
+        {"$group": {"_id": {"feedstock": "$feedstock", "omega_threshold": "$omega_threshold"}}}
+    ]).to_list(None)
+    for d in datasets:
+        feedstock, omega = d["_id"]["feedstock"], d["_id"]["omega_threshold"]
+        version = await get_dataset_version(feedstock, omega)
+        current = await db.summary_stats.find_one(
+            {"feedstock": feedstock, "omega_threshold": omega, "region": SUMMARY_TOTAL_REGION, "quality": "all"},
+            {"_id": 0, "version": 1})
+        if not current or current.get("version") != version:
+            await refresh_summary_stats(feedstock, omega)
+
+
+async def on_dataset_changed(feedstock, omega):
+    await bump_dataset_version(feedstock, omega)
+    await refresh_summary_stats(feedstock, omega)
+
+
 # ── Seed ──
 async def seed_data():
     count = await db.erw_samples.count_documents({})
@@ -75,91 +630,12 @@ async def seed_data():
                 continue
             if row[2] is None and row[3] is None and row[4] is None:
                 continue
-            sample = {
-                "id": str(uuid.uuid4()),
-                "feedstock": "calcite",
-                "omega_threshold": 5,
-                "sample_no": str(row[0]) if row[0] else "",
-                "river_type": str(row[1]) if row[1] else "",
-                "latitude": safe_float(row[2]),
-                "longitude": safe_float(row[3]),
-                "ph": safe_float(row[4]),
-                "alkalinity": safe_float(row[5]),
-                "temp_c": safe_float(row[6]),
-                "ca": safe_float(row[7]),
-                "mg": safe_float(row[8]),
-                "na": safe_float(row[9]),
-                "k": safe_float(row[10]),
-                "cl": safe_float(row[11]),
-                "so4": safe_float(row[12]),
-                "no3": safe_float(row[13]),
-                "salinity": safe_float(row[15]),
-                "ksp": safe_float(row[17]),
-                "hco3": safe_float(row[20]),
-                "co3": safe_float(row[21]),
-                "co2_aq": safe_float(row[22]),
-                "dic": safe_float(row[23]),
-                "pco2": safe_float(row[24]),
-                "fco2": safe_float(row[25]),
-                "z_plus": safe_float(row[27]),
-                "z_minus": safe_float(row[28]),
-                "nicb": safe_float(row[29]),
-                "omega_calcite": safe_float(row[31]),
-                "si_calcite": safe_float(row[32]),
-                "state": str(row[34]) if row[34] else "",
-                "region": str(row[35]) if row[35] else "",
-                "river_name": str(row[36]) if row[36] else "",
-                "discharge": safe_float(row[37]),
-                "source": str(row[38]) if row[38] else "",
-                "j_steps": safe_int(row[40]),
-                "k_steps": safe_int(row[41]),
-                "rock_addition": safe_float(row[42]),
-                "omega_flag": safe_int(row[43]),
-                "success_flag": safe_int(row[44]),
-                "omega_final": safe_float(row[47]),
-                "ca_final": safe_float(row[48]),
-                "alk_final": safe_float(row[50]),
-                "dic_final": safe_float(row[51]),
-                "ph_final": safe_float(row[53]),
-                "pco2_final": safe_float(row[55]),
-                "discharge_ms": safe_float(row[57]),
-                "cdr_mol_s": safe_float(row[58]),
-                "cdr_t_yr": safe_float(row[59]),
-                "cdr_kt_yr": safe_float(row[60]),
-            }
-            samples.append(sample)
+            samples.append(parse_sample_row(row, "calcite", 5))
         if samples:
             await db.erw_samples.insert_many(samples)
+            await on_dataset_changed("calcite", 5)
             logger.info(f"Seeded {len(samples)} samples")
 
-        ws2 = wb['Summary Statistics']
-        summaries = []
-        for row in ws2.iter_rows(min_row=4, max_row=ws2.max_row, values_only=True):
-            if not row[0] or str(row[0]).strip() == '':
-                continue
-            summaries.append({
-                "id": str(uuid.uuid4()),
-                "feedstock": "calcite",
-                "omega_threshold": 5,
-                "region": str(row[0]),
-                "add_mean": safe_float(row[1]) or 0,
-                "add_median": safe_float(row[2]) or 0,
-                "add_std": safe_float(row[3]) or 0,
-                "add_min": safe_float(row[4]) or 0,
-                "add_max": safe_float(row[5]) or 0,
-                "n_samples": safe_int(row[6]) or 0,
-                "omega_mean": safe_float(row[7]) or 0,
-                "omega_median": safe_float(row[8]) or 0,
-                "omega_std": safe_float(row[9]) or 0,
-                "cdr_mean": safe_float(row[10]) or 0,
-                "cdr_total": safe_float(row[11]) or 0,
-                "n_with_q": safe_int(row[12]) or 0,
-                "success_pct": safe_float(row[13]) or 0,
-            })
-        if summaries:
-            await db.summary_stats.insert_many(summaries)
-            logger.info(f"Seeded {len(summaries)} summary stats")
-
         await db.feedstocks.insert_one({
             "id": str(uuid.uuid4()),
             "name": "calcite",
@@ -177,17 +653,20 @@ async def seed_data():
 @app.on_event("startup")
 async def startup():
     await seed_data()
+    await ensure_indexes()
+    await refresh_stale_summaries()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+    bootstrap_pool.shutdown(wait=False)
 
 
 # ── Dashboard Overview ──
-@api_router.get("/dashboard/overview")
-async def dashboard_overview(feedstock: str = "calcite", omega: int = 5):
+@api_router.get("/dashboard/overview", response_model=DashboardOverview)
+async def dashboard_overview(feedstock: str = "calcite", omega: int = 5, quality: Optional[str] = None):
     pipeline = [
-        {"$match": {"feedstock": feedstock, "omega_threshold": omega, "cdr_t_yr": {"$ne": None, "$gt": 0}}},
+        {"$match": sample_match(feedstock, omega, quality, cdr_t_yr={"$ne": None, "$gt": 0})},
         {"$group": {
             "_id": None,
             "total_cdr_t_yr": {"$sum": "$cdr_t_yr"},
@@ -200,8 +679,8 @@ async def dashboard_overview(feedstock: str = "calcite", omega: int = 5):
         }}
     ]
     result = await db.erw_samples.aggregate(pipeline).to_list(1)
-    total = await db.erw_samples.count_documents({"feedstock": feedstock, "omega_threshold": omega})
-    successful = await db.erw_samples.count_documents({"feedstock": feedstock, "omega_threshold": omega, "success_flag": 1})
+    total = await db.erw_samples.count_documents(sample_match(feedstock, omega, quality))
+    successful = await db.erw_samples.count_documents(sample_match(feedstock, omega, quality, success_flag=1))
     r = result[0] if result else {}
     return {
         "total_cdr_t_yr": r.get("total_cdr_t_yr", 0),
@@ -213,32 +692,27 @@ async def dashboard_overview(feedstock: str = "calcite", omega: int = 5):
         "avg_rock_addition": r.get("avg_rock_addition", 0),
         "avg_omega_final": r.get("avg_omega_final", 0),
         "success_rate": (successful / total * 100) if total > 0 else 0,
-        "feedstock": feedstock, "omega_threshold": omega,
+        "feedstock": feedstock, "omega_threshold": omega, "quality": quality or "all",
     }
 
 
 # ── Full analytics data (all fields for all charts) ──
-@api_router.get("/analytics/full")
-async def analytics_full(feedstock: str = "calcite", omega: int = 5):
+@api_router.get("/analytics/full", response_model=List[AnalyticsRecord])
+@coalesced
+async def analytics_full(feedstock: str = "calcite", omega: int = 5, quality: Optional[str] = None):
     pipeline = [
-        {"$match": {"feedstock": feedstock, "omega_threshold": omega}},
-        {"$project": {
-            "_id": 0, "ph": 1, "alkalinity": 1, "dic": 1, "pco2": 1, "fco2": 1,
-            "temp_c": 1, "rock_addition": 1, "cdr_t_yr": 1, "omega_calcite": 1,
-            "si_calcite": 1, "omega_final": 1, "discharge": 1, "region": 1, "state": 1,
-            "ca": 1, "mg": 1, "na": 1, "k": 1, "hco3": 1, "co3": 1, "co2_aq": 1,
-            "salinity": 1, "z_plus": 1, "z_minus": 1, "nicb": 1, "cl": 1, "so4": 1,
-            "no3": 1, "latitude": 1, "longitude": 1, "river_name": 1, "sample_no": 1,
-        }}
+        {"$match": sample_match(feedstock, omega, quality)},
+        {"$project": {"_id": 0, **{f: 1 for f in ANALYTICS_FIELDS}}}
     ]
     return await db.erw_samples.aggregate(pipeline).to_list(2000)
 
 
 # ── Basin aggregations for analytics charts ──
-@api_router.get("/analytics/basin-stats")
-async def basin_stats(feedstock: str = "calcite", omega: int = 5):
+@api_router.get("/analytics/basin-stats", response_model=List[BasinStat])
+@coalesced
+async def basin_stats(feedstock: str = "calcite", omega: int = 5, quality: Optional[str] = None):
     pipeline = [
-        {"$match": {"feedstock": feedstock, "omega_threshold": omega, "region": {"$ne": ""}}},
+        {"$match": sample_match(feedstock, omega, quality, region={"$ne": ""})},
         {"$group": {
             "_id": "$region",
             "count": {"$sum": 1},
@@ -276,10 +750,10 @@ async def basin_stats(feedstock: str = "calcite", omega: int = 5):
 
 
 # ── NICB quality stats by basin ──
-@api_router.get("/analytics/nicb-quality")
-async def nicb_quality(feedstock: str = "calcite", omega: int = 5):
+@api_router.get("/analytics/nicb-quality", response_model=List[NicbQuality])
+async def nicb_quality(feedstock: str = "calcite", omega: int = 5, quality: Optional[str] = None):
     pipeline = [
-        {"$match": {"feedstock": feedstock, "omega_threshold": omega, "nicb": {"$ne": None}, "region": {"$ne": ""}}},
+        {"$match": sample_match(feedstock, omega, quality, nicb={"$ne": None}, region={"$ne": ""})},
         {"$group": {
             "_id": "$region",
             "count": {"$sum": 1},
@@ -298,17 +772,104 @@ async def nicb_quality(feedstock: str = "calcite", omega: int = 5):
     } for r in results]
 
 
+# ── Bootstrap confidence intervals ──
+# Elements per index array: each chunk holds budget // n resamples, so a chunk's int32 indices plus
+# float64 values take ~12 bytes * budget (~12 MB per worker) whatever the group size
+BOOTSTRAP_ELEMENT_BUDGET = 1_000_000
+bootstrap_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("BOOTSTRAP_WORKERS", "4")))
+BOOTSTRAP_CONFIDENCE_LEVELS = (80, 90, 95, 99)
+BOOTSTRAP_CACHE_SIZE = 32  # results kept per dataset, least recently used evicted first
+# (feedstock, omega) -> (dataset version, OrderedDict[(group_by, n_boot, confidence, quality)] -> result)
+_bootstrap_cache = {}
+
+
+def _bootstrap_interval(values, stat, n_boot, confidence, rng):
+    n = len(values)
+    if n == 0:
+        return {"estimate": None, "lower": None, "upper": None}
+    estimates = np.empty(n_boot)
+    chunk = max(1, BOOTSTRAP_ELEMENT_BUDGET // n)
+    for start in range(0, n_boot, chunk):
+        size = min(chunk, n_boot - start)
+        resampled = values[rng.integers(0, n, size=(size, n), dtype=np.int32)]
+        estimates[start:start + size] = resampled.sum(axis=1) if stat == "sum" else resampled.mean(axis=1)
+    tail = (100 - confidence) / 2
+    lower, upper = np.percentile(estimates, [tail, 100 - tail])
+    point = values.sum() if stat == "sum" else values.mean()
+    return {"estimate": float(point), "lower": float(lower), "upper": float(upper)}
+
+
+def bootstrap_group(name, cdr, rock, n_boot, confidence):
+    # Stable per-group seed so cached and recomputed intervals agree
+    rng = np.random.default_rng(zlib.crc32(name.encode("utf-8")))
+    cdr_known = cdr[~np.isnan(cdr)]
+    return {
+        "group": name, "count": int(len(cdr)),
+        # Missing CDR counts as 0 in totals and is skipped in means, like $sum / $avg
+        "total_cdr": _bootstrap_interval(np.nan_to_num(cdr), "sum", n_boot, confidence, rng),
+        "mean_cdr": _bootstrap_interval(cdr_known, "mean", n_boot, confidence, rng),
+        "mean_rock_addition": _bootstrap_interval(rock[~np.isnan(rock)], "mean", n_boot, confidence, rng),
+    }
+
+
+@api_router.get("/analytics/bootstrap-ci", response_model=BootstrapCI)
+async def bootstrap_ci(feedstock: str = "calcite", omega: int = 5, group_by: str = "region",
+                       n_boot: int = 2000, confidence: int = 95, quality: Optional[str] = None):
+    if group_by not in ("region", "state"):
+        raise HTTPException(status_code=400, detail="group_by must be 'region' or 'state'")
+    if not 100 <= n_boot <= 20000:
+        raise HTTPException(status_code=400, detail="n_boot must be between 100 and 20000")
+    if confidence not in BOOTSTRAP_CONFIDENCE_LEVELS:
+        raise HTTPException(status_code=400, detail=f"confidence must be one of {list(BOOTSTRAP_CONFIDENCE_LEVELS)}")
+    query = sample_match(feedstock, omega, quality, **{group_by: {"$ne": ""}})
+    key = (group_by, n_boot, confidence, quality or "all")
+    version = await get_dataset_version(feedstock, omega)
+    cached_version, results = _bootstrap_cache.get((feedstock, omega), (None, None))
+    if cached_version != version:
+        # New dataset version: every result computed for the old one is dropped when this one is stored
+        results = OrderedDict()
+    if key in results:
+        results.move_to_end(key)
+        return results[key]
+
+    columns = {}
+    cursor = db.erw_samples.find(query, {"_id": 0, group_by: 1, "cdr_t_yr": 1, "rock_addition": 1})
+    async for doc in cursor:
+        group = columns.setdefault(doc.get(group_by), ([], []))
+        group[0].append(doc.get("cdr_t_yr"))
+        group[1].append(doc.get("rock_addition"))
+    loop = asyncio.get_running_loop()
+    groups = await asyncio.gather(*(
+        loop.run_in_executor(bootstrap_pool, bootstrap_group, name, np.array(cdr, dtype=float),
+                             np.array(rock, dtype=float), n_boot, confidence)
+        for name, (cdr, rock) in columns.items() if name
+    ))
+    result = {
+        "feedstock": feedstock, "omega_threshold": omega, "group_by": group_by, "quality": quality or "all",
+        "n_boot": n_boot, "confidence": confidence, "version": version,
+        "groups": sorted(groups, key=lambda g: g["total_cdr"]["estimate"] or 0, reverse=True),
+    }
+    if columns:  # unknown feedstock/omega combinations are not cached
+        results[key] = result
+        if len(results) > BOOTSTRAP_CACHE_SIZE:
+            results.popitem(last=False)
+        _bootstrap_cache[(feedstock, omega)] = (version, results)
+    return result
+
+
 # ── Summary ──
-@api_router.get("/summary")
-async def get_summary(feedstock: str = "calcite", omega: int = 5):
-    return await db.summary_stats.find({"feedstock": feedstock, "omega_threshold": omega}, {"_id": 0}).to_list(100)
+@api_router.get("/summary", response_model=List[SummaryStat])
+async def get_summary(feedstock: str = "calcite", omega: int = 5, quality: Optional[str] = None):
+    quality_max_tier(quality)  # validates
+    query = {"feedstock": feedstock, "omega_threshold": omega, "quality": quality or "all"}
+    return await db.summary_stats.find(query, {"_id": 0}).to_list(100)
 
 
 # ── Region CDR ──
-@api_router.get("/regions/cdr")
-async def regions_cdr(feedstock: str = "calcite", omega: int = 5):
+@api_router.get("/regions/cdr", response_model=List[RegionCdr])
+async def regions_cdr(feedstock: str = "calcite", omega: int = 5, quality: Optional[str] = None):
     pipeline = [
-        {"$match": {"feedstock": feedstock, "omega_threshold": omega, "region": {"$ne": ""}}},
+        {"$match": sample_match(feedstock, omega, quality, region={"$ne": ""})},
         {"$group": {
             "_id": "$region", "total_cdr": {"$sum": "$cdr_t_yr"}, "avg_cdr": {"$avg": "$cdr_t_yr"},
             "count": {"$sum": 1}, "avg_ph": {"$avg": "$ph"}, "avg_rock_add": {"$avg": "$rock_addition"},
@@ -321,24 +882,57 @@ async def regions_cdr(feedstock: str = "calcite", omega: int = 5):
 
 
 # ── Map data ──
-@api_router.get("/samples/map")
-async def get_map_data(feedstock: str = "calcite", omega: int = 5):
+@api_router.get("/samples/map", response_model=List[MapPoint])
+async def get_map_data(feedstock: str = "calcite", omega: int = 5, quality: Optional[str] = None):
     pipeline = [
-        {"$match": {"feedstock": feedstock, "omega_threshold": omega,
-                     "latitude": {"$ne": None}, "longitude": {"$ne": None}}},
-        {"$project": {"_id": 0, "latitude": 1, "longitude": 1, "river_name": 1,
-                      "state": 1, "region": 1, "cdr_t_yr": 1, "alkalinity": 1,
-                      "ph": 1, "rock_addition": 1, "omega_final": 1, "sample_no": 1,
-                      "ca": 1, "mg": 1, "hco3": 1, "dic": 1, "si_calcite": 1}}
+        {"$match": sample_match(feedstock, omega, quality, latitude={"$ne": None}, longitude={"$ne": None})},
+        {"$project": {"_id": 0, **{f: 1 for f in MAP_FIELDS}}}
     ]
     return await db.erw_samples.aggregate(pipeline).to_list(2000)
 
 
+# ── Spatial queries ──
+GEO_PROJECTION = {"_id": 0, **{f: 1 for f in GEO_FIELDS}, "distance_km": 1}
+
+
+def _geo_near_pipeline(lat, lon, feedstock, omega, quality, limit, max_km=None):
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise HTTPException(status_code=400, detail="lat must be in [-90, 90] and lon in [-180, 180]")
+    geo_near = {
+        "near": {"type": "Point", "coordinates": [lon, lat]},
+        "distanceField": "distance_km", "distanceMultiplier": 0.001, "spherical": True,
+        "key": "location", "query": sample_match(feedstock, omega, quality),
+    }
+    if max_km is not None:
+        geo_near["maxDistance"] = max_km * 1000
+    return [{"$geoNear": geo_near}, {"$limit": limit}, {"$project": GEO_PROJECTION}]
+
+
+@api_router.get("/samples/nearest", response_model=List[GeoSample])
+async def nearest_samples(lat: float, lon: float, feedstock: str = "calcite", omega: int = 5,
+                          k: int = 10, max_km: Optional[float] = None, quality: Optional[str] = None):
+    if max_km is not None and max_km <= 0:
+        raise HTTPException(status_code=400, detail="max_km must be positive")
+    k = max(1, min(k, 500))
+    pipeline = _geo_near_pipeline(lat, lon, feedstock, omega, quality, k, max_km)
+    return await db.erw_samples.aggregate(pipeline).to_list(k)
+
+
+@api_router.get("/samples/within", response_model=List[GeoSample])
+async def samples_within(lat: float, lon: float, radius_km: float = 50, feedstock: str = "calcite",
+                         omega: int = 5, limit: int = 500, quality: Optional[str] = None):
+    if radius_km <= 0:
+        raise HTTPException(status_code=400, detail="radius_km must be positive")
+    limit = max(1, min(limit, 5000))
+    pipeline = _geo_near_pipeline(lat, lon, feedstock, omega, quality, limit, radius_km)
+    return await db.erw_samples.aggregate(pipeline).to_list(limit)
+
+
 # ── Samples ──
-@api_router.get("/samples")
+@api_router.get("/samples", response_model=SamplesPage)
 async def get_samples(feedstock: str = "calcite", omega: int = 5, region: Optional[str] = None,
-                      state: Optional[str] = None, limit: int = 200, skip: int = 0):
-    query = {"feedstock": feedstock, "omega_threshold": omega}
+                      state: Optional[str] = None, limit: int = 200, skip: int = 0, quality: Optional[str] = None):
+    query = sample_match(feedstock, omega, quality)
     if region:
         query["region"] = region
     if state:
@@ -348,26 +942,203 @@ async def get_samples(feedstock: str = "calcite", omega: int = 5, region: Option
     return {"samples": docs, "total": total}
 
 
+# ── Export ──
+EXPORT_BATCH_SIZE = 5000
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+async def _cursor_batches(cursor, size):
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _export_csv(cursor, fields):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    async for batch in _cursor_batches(cursor, EXPORT_BATCH_SIZE):
+        writer.writerows(batch)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+async def _export_ndjson(cursor, fields):
+    async for batch in _cursor_batches(cursor, EXPORT_BATCH_SIZE):
+        yield b"".join(orjson.dumps({f: d.get(f) for f in fields}) + b"\n" for d in batch)
+
+
+async def _export_parquet(cursor, fields):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    arrow_types = {"str": pa.string(), "float": pa.float64(), "int": pa.int64()}
+    schema = pa.schema([(f, arrow_types[SAMPLE_FIELDS[f]]) for f in fields])
+    sink = io.BytesIO()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        # One row group per batch; drain the sink after each so memory stays flat
+        async for batch in _cursor_batches(cursor, EXPORT_BATCH_SIZE):
+            columns = {f: [d.get(f) for d in batch] for f in fields}
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate(0)
+    finally:
+        writer.close()
+    yield sink.getvalue()
+
+
+async def _closing_stream(cursor, chunks):
+    """Yield from `chunks`, closing the Motor cursor even when the client disconnects mid-download."""
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        # Shielded: on disconnect the stream is cancelled, and an unshielded await here would be too
+        with anyio.CancelScope(shield=True):
+            await chunks.aclose()
+            await cursor.close()
+
+
+@api_router.get("/export")
+async def export_samples(fmt: str = Query("csv", alias="format"), feedstock: Optional[str] = None, omega: Optional[int] = None,
+                         region: Optional[str] = None, state: Optional[str] = None, fields: Optional[str] = None,
+                         quality: Optional[str] = None):
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{fmt}', use one of {sorted(EXPORT_MEDIA_TYPES)}")
+    columns = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(SAMPLE_FIELDS)
+    unknown = [f for f in columns if f not in SAMPLE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+    query = {}
+    if feedstock:
+        query["feedstock"] = feedstock
+    if omega is not None:
+        query["omega_threshold"] = omega
+    if region:
+        query["region"] = region
+    if state:
+        query["state"] = state
+    max_tier = quality_max_tier(quality)
+    if max_tier is not None:
+        query["nicb_tier"] = {"$lte": max_tier}
+    projection = {"_id": 0, **{f: 1 for f in columns}}
+    cursor = db.erw_samples.find(query, projection).batch_size(EXPORT_BATCH_SIZE)
+    stream = {"csv": _export_csv, "ndjson": _export_ndjson, "parquet": _export_parquet}[fmt]
+    # Whitelist the client-supplied feedstock so it cannot break the header quoting
+    safe_feedstock = re.sub(r"[^A-Za-z0-9_-]", "_", feedstock) if feedstock else "all"
+    filename = f"erw_samples_{safe_feedstock}_{omega if omega is not None else 'all'}.{fmt}"
+    return StreamingResponse(_closing_stream(cursor, stream(cursor, columns)), media_type=EXPORT_MEDIA_TYPES[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 # ── Filters ──
-@api_router.get("/filters")
-async def get_filters(feedstock: str = "calcite", omega: int = 5):
-    query = {"feedstock": feedstock, "omega_threshold": omega}
-    regions = await db.erw_samples.distinct("region", query)
-    states = await db.erw_samples.distinct("state", query)
-    return {"regions": sorted([r for r in regions if r]), "states": sorted([s for s in states if s])}
+FACET_FIELDS = ("region", "state", "river_name", "river_type")
+_facet_index = {}  # (feedstock, omega) -> (dataset version, cells)
+
+
+async def get_facet_cells(feedstock, omega):
+    """Per-(region, state, river, river_type, nicb_tier) counts and CDR totals, rebuilt once per dataset version."""
+    version = await get_dataset_version(feedstock, omega)
+    cached = _facet_index.get((feedstock, omega))
+    if cached and cached[0] == version:
+        return version, cached[1]
+    pipeline = [
+        {"$match": {"feedstock": feedstock, "omega_threshold": omega}},
+        {"$group": {
+            "_id": {**{f: f"${f}" for f in FACET_FIELDS}, "nicb_tier": "$nicb_tier"},
+            "count": {"$sum": 1}, "total_cdr": {"$sum": "$cdr_t_yr"},
+        }},
+    ]
+    cells = [{**{f: r["_id"].get(f) or "" for f in FACET_FIELDS}, "nicb_tier": r["_id"].get("nicb_tier"),
+              "count": r["count"], "total_cdr": r["total_cdr"] or 0}
+             async for r in db.erw_samples.aggregate(pipeline)]
+    if cells:  # unknown feedstock/omega combinations are not cached
+        _facet_index[(feedstock, omega)] = (version, cells)
+    else:
+        _facet_index.pop((feedstock, omega), None)
+    return version, cells
+
+
+def screen_cells(cells, quality):
+    max_tier = quality_max_tier(quality)
+    if max_tier is None:
+        return cells
+    return [c for c in cells if c["nicb_tier"] is not None and c["nicb_tier"] <= max_tier]
+
+
+def compute_facets(cells, selection):
+    """Cross-filter: each facet is narrowed by every selected field except its own."""
+    def matches(cell, skip=None):
+        return all(cell[f] == v for f, v in selection.items() if f != skip)
+
+    facets = {}
+    for field in FACET_FIELDS:
+        values = {}
+        for cell in cells:
+            if not cell[field] or not matches(cell, skip=field):
+                continue
+            bucket = values.setdefault(cell[field], {"value": cell[field], "count": 0, "total_cdr": 0})
+            bucket["count"] += cell["count"]
+            bucket["total_cdr"] += cell["total_cdr"]
+        facets[field] = sorted(values.values(), key=lambda b: b["value"])
+    selected = [c for c in cells if matches(c)]
+    return {
+        "facets": facets,
+        "total": {"count": sum(c["count"] for c in selected), "total_cdr": sum(c["total_cdr"] for c in selected)},
+    }
+
+
+@api_router.get("/filters", response_model=Filters)
+async def get_filters(feedstock: str = "calcite", omega: int = 5, region: Optional[str] = None, state: Optional[str] = None,
+                      quality: Optional[str] = None):
+    _, cells = await get_facet_cells(feedstock, omega)
+    cells = screen_cells(cells, quality)
+    selection = {f: v for f, v in (("region", region), ("state", state)) if v}
+    facets = compute_facets(cells, selection)["facets"]
+    return {"regions": [b["value"] for b in facets["region"]], "states": [b["value"] for b in facets["state"]]}
+
+
+@api_router.get("/filters/facets", response_model=Facets)
+async def get_facets(feedstock: str = "calcite", omega: int = 5, region: Optional[str] = None,
+                     state: Optional[str] = None, river_name: Optional[str] = None, river_type: Optional[str] = None,
+                     quality: Optional[str] = None):
+    version, cells = await get_facet_cells(feedstock, omega)
+    cells = screen_cells(cells, quality)
+    selection = {f: v for f, v in (("region", region), ("state", state), ("river_name", river_name),
+                                   ("river_type", river_type)) if v}
+    return {**compute_facets(cells, selection), "selection": selection, "version": version,
+            "feedstock": feedstock, "omega_threshold": omega, "quality": quality or "all"}
 
 
 # ── Feedstocks ──
-@api_router.get("/feedstocks")
+@api_router.get("/feedstocks", response_model=List[Feedstock])
 async def list_feedstocks():
     return await db.feedstocks.find({}, {"_id": 0}).to_list(50)
 
 
 # ── Upload ──
-@api_router.post("/feedstock/upload")
+@api_router.post("/feedstock/upload", response_model=UploadResult)
 async def upload_feedstock(file: UploadFile = File(...), feedstock_name: str = "unknown", omega_threshold: int = 5):
     try:
-        import openpyxl, io
+        import openpyxl
         content = await file.read()
         wb = openpyxl.load_workbook(io.BytesIO(content), data_only=True)
         ws = wb.active
@@ -377,50 +1148,10 @@ async def upload_feedstock(file: UploadFile = File(...), feedstock_name: str = "
                 continue
             if row[2] is None and row[3] is None and row[4] is None:
                 continue
-            samples.append({
-                "id": str(uuid.uuid4()), "feedstock": feedstock_name.lower(), "omega_threshold": omega_threshold,
-                "sample_no": str(row[0]) if row[0] else "", "river_type": str(row[1]) if row[1] else "",
-                "latitude": safe_float(row[2]), "longitude": safe_float(row[3]),
-                "ph": safe_float(row[4]), "alkalinity": safe_float(row[5]), "temp_c": safe_float(row[6]),
-                "ca": safe_float(row[7]), "mg": safe_float(row[8]), "na": safe_float(row[9]),
-                "k": safe_float(row[10]), "cl": safe_float(row[11]), "so4": safe_float(row[12]),
-                "no3": safe_float(row[13]), "salinity": safe_float(row[15]), "ksp": safe_float(row[17]),
-                "hco3": safe_float(row[20]), "co3": safe_float(row[21]), "co2_aq": safe_float(row[22]),
-                "dic": safe_float(row[23]), "pco2": safe_float(row[24]), "fco2": safe_float(row[25]),
-                "z_plus": safe_float(row[27]), "z_minus": safe_float(row[28]), "nicb": safe_float(row[29]),
-                "omega_calcite": safe_float(row[31]), "si_calcite": safe_float(row[32]),
-                "state": str(row[34]) if row[34] else "", "region": str(row[35]) if row[35] else "",
-                "river_name": str(row[36]) if row[36] else "", "discharge": safe_float(row[37]),
-                "source": str(row[38]) if row[38] else "",
-                "j_steps": safe_int(row[40]), "k_steps": safe_int(row[41]),
-                "rock_addition": safe_float(row[42]), "omega_flag": safe_int(row[43]),
-                "success_flag": safe_int(row[44]), "omega_final": safe_float(row[47]),
-                "ca_final": safe_float(row[48]), "alk_final": safe_float(row[50]),
-                "dic_final": safe_float(row[51]), "ph_final": safe_float(row[53]),
-                "pco2_final": safe_float(row[55]), "discharge_ms": safe_float(row[57]),
-                "cdr_mol_s": safe_float(row[58]), "cdr_t_yr": safe_float(row[59]),
-                "cdr_kt_yr": safe_float(row[60]),
-            })
+            samples.append(parse_sample_row(row, feedstock_name.lower(), omega_threshold))
         if samples:
             await db.erw_samples.insert_many(samples)
-        if 'Summary Statistics' in wb.sheetnames:
-            ws2 = wb['Summary Statistics']
-            summaries = []
-            for row in ws2.iter_rows(min_row=4, max_row=ws2.max_row, values_only=True):
-                if not row[0] or str(row[0]).strip() == '':
-                    continue
-                summaries.append({
-                    "id": str(uuid.uuid4()), "feedstock": feedstock_name.lower(), "omega_threshold": omega_threshold,
-                    "region": str(row[0]), "add_mean": safe_float(row[1]) or 0, "add_median": safe_float(row[2]) or 0,
-                    "add_std": safe_float(row[3]) or 0, "add_min": safe_float(row[4]) or 0,
-                    "add_max": safe_float(row[5]) or 0, "n_samples": safe_int(row[6]) or 0,
-                    "omega_mean": safe_float(row[7]) or 0, "omega_median": safe_float(row[8]) or 0,
-                    "omega_std": safe_float(row[9]) or 0, "cdr_mean": safe_float(row[10]) or 0,
-                    "cdr_total": safe_float(row[11]) or 0, "n_with_q": safe_int(row[12]) or 0,
-                    "success_pct": safe_float(row[13]) or 0,
-                })
-            if summaries:
-                await db.summary_stats.insert_many(summaries)
+            await on_dataset_changed(feedstock_name.lower(), omega_threshold)
         existing = await db.feedstocks.find_one({"name": feedstock_name.lower()})
         if existing:
             thresholds = existing.get("omega_thresholds", [])
@@ -442,13 +1173,14 @@ async def upload_feedstock(file: UploadFile = File(...), feedstock_name: str = "
 
 
 # ── Comparison ──
-@api_router.get("/comparison")
-async def omega_comparison(feedstock: str = "calcite"):
+@api_router.get("/comparison", response_model=List[OmegaComparison])
+@coalesced
+async def omega_comparison(feedstock: str = "calcite", quality: Optional[str] = None):
     thresholds = await db.erw_samples.distinct("omega_threshold", {"feedstock": feedstock})
     results = []
     for omega in sorted(thresholds):
         pipeline = [
-            {"$match": {"feedstock": feedstock, "omega_threshold": omega}},
+            {"$match": sample_match(feedstock, omega, quality)},
             {"$group": {
                 "_id": "$region",
                 "total_cdr": {"$sum": "$cdr_t_yr"}, "avg_cdr": {"$avg": "$cdr_t_yr"},
@@ -459,7 +1191,7 @@ async def omega_comparison(feedstock: str = "calcite"):
         ]
         regions = await db.erw_samples.aggregate(pipeline).to_list(50)
         total_pipeline = [
-            {"$match": {"feedstock": feedstock, "omega_threshold": omega}},
+            {"$match": sample_match(feedstock, omega, quality)},
             {"$group": {"_id": None, "total_cdr": {"$sum": "$cdr_t_yr"}, "avg_rock_add": {"$avg": "$rock_addition"}, "count": {"$sum": 1}}}
         ]
         totals = await db.erw_samples.aggregate(total_pipeline).to_list(1)
@@ -476,10 +1208,10 @@ async def omega_comparison(feedstock: str = "calcite"):
 
 
 # ── Top Rivers ──
-@api_router.get("/rivers/top")
-async def top_rivers(feedstock: str = "calcite", omega: int = 5, limit: int = 20):
+@api_router.get("/rivers/top", response_model=List[TopRiver])
+async def top_rivers(feedstock: str = "calcite", omega: int = 5, limit: int = 20, quality: Optional[str] = None):
     pipeline = [
-        {"$match": {"feedstock": feedstock, "omega_threshold": omega, "river_name": {"$ne": ""}, "cdr_t_yr": {"$ne": None}}},
+        {"$match": sample_match(feedstock, omega, quality, river_name={"$ne": ""}, cdr_t_yr={"$ne": None})},
         {"$group": {
             "_id": "$river_name", "total_cdr": {"$sum": "$cdr_t_yr"}, "avg_cdr": {"$avg": "$cdr_t_yr"},
             "count": {"$sum": 1}, "region": {"$first": "$region"}, "state": {"$first": "$state"},
@@ -492,10 +1224,10 @@ async def top_rivers(feedstock: str = "calcite", omega: int = 5, limit: int = 20
 
 
 # ── States CDR ──
-@api_router.get("/states/cdr")
-async def states_cdr(feedstock: str = "calcite", omega: int = 5):
+@api_router.get("/states/cdr", response_model=List[StateCdr])
+async def states_cdr(feedstock: str = "calcite", omega: int = 5, quality: Optional[str] = None):
     pipeline = [
-        {"$match": {"feedstock": feedstock, "omega_threshold": omega, "state": {"$ne": ""}}},
+        {"$match": sample_match(feedstock, omega, quality, state={"$ne": ""})},
         {"$group": {"_id": "$state", "total_cdr": {"$sum": "$cdr_t_yr"}, "avg_cdr": {"$avg": "$cdr_t_yr"}, "count": {"$sum": 1}}},
         {"$sort": {"total_cdr": -1}}
     ]
@@ -509,7 +1241,7 @@ async def chat_endpoint(req: ChatRequest):
     try:
         from emergentintegrations.llm.chat import LlmChat, UserMessage
         api_key = os.environ.get("EMERGENT_LLM_KEY", "")
-        summary_docs = await db.summary_stats.find({}, {"_id": 0}).to_list(100)
+        summary_docs = await db.summary_stats.find({"quality": "all"}, {"_id": 0}).to_list(100)
         feedstock_docs = await db.feedstocks.find({}, {"_id": 0}).to_list(50)
         total = await db.erw_samples.count_documents({})
         regions = await db.erw_samples.distinct("region")
@@ -536,12 +1268,77 @@ Answer accurately using data. If unsure, say so."""
         logger.error(f"Chat error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.get("/chat/history")
+@api_router.get("/system/single-flight", response_model=SingleFlightMetrics)
+async def single_flight_metrics():
+    return single_flight.metrics()
+
+
+@api_router.get("/chat/history", response_model=List[ChatMessage])
 async def chat_history(session_id: str = "default", limit: int = 50):
     return await db.chat_messages.find({"session_id": session_id}, {"_id": 0}).sort("timestamp", 1).to_list(limit)
 
 
+# ── Batch ──
+MAX_BATCH_SIZE = 25
+_batch_routes = {}  # path without /api prefix -> (endpoint, {param: (TypeAdapter, default)})
+
+
+def get_batch_routes():
+    """GET handlers on api_router with their param validators (streaming routes excluded)."""
+    if not _batch_routes:
+        for route in api_router.routes:
+            if isinstance(route, APIRoute) and "GET" in route.methods and route.endpoint is not export_samples:
+                params = {name: (TypeAdapter(p.annotation), p.default)
+                          for name, p in inspect.signature(route.endpoint).parameters.items()}
+                _batch_routes[route.path[len(api_router.prefix):]] = (route.endpoint, params)
+    return _batch_routes
+
+
+async def run_batch_item(item: BatchItem):
+    path, _, query = item.route.partition("?")
+    path = "/" + path.strip("/")
+    if path.startswith(api_router.prefix + "/"):
+        path = path[len(api_router.prefix):]
+    if path not in get_batch_routes():
+        return {"route": item.route, "status": 404, "error": f"Unknown or non-batchable route '{item.route}'"}
+    endpoint, params = get_batch_routes()[path]
+    # Query-string params are honoured; explicit `params` win on conflict
+    values = {**dict(parse_qsl(query, keep_blank_values=True)), **item.params}
+    unknown = [k for k in values if k not in params]
+    if unknown:
+        return {"route": item.route, "status": 422, "error": f"Unknown params: {', '.join(unknown)}"}
+    try:
+        kwargs = {}
+        for name, (adapter, default) in params.items():
+            if name in values:
+                try:
+                    kwargs[name] = adapter.validate_python(values[name])
+                except ValidationError as e:
+                    return {"route": item.route, "status": 422,
+                            "error": f"Invalid value for '{name}': {e.errors()[0]['msg']}"}
+            elif default is inspect.Parameter.empty:
+                return {"route": item.route, "status": 422, "error": f"Missing required param '{name}'"}
+        data = await endpoint(**kwargs)
+        if isinstance(data, Response):
+            return {"route": item.route, "status": 422, "error": "Route returns a raw response and cannot be batched"}
+        return {"route": item.route, "status": 200, "data": data}
+    except HTTPException as e:
+        return {"route": item.route, "status": e.status_code, "error": e.detail}
+    except Exception as e:
+        logger.error(f"Batch item {item.route} error: {e}")
+        return {"route": item.route, "status": 500, "error": str(e)}
+
+
+@api_router.post("/batch", response_model=BatchResponse)
+async def batch(req: BatchRequest):
+    if len(req.requests) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} requests per batch")
+    results = await asyncio.gather(*(run_batch_item(item) for item in req.requests))
+    return {"results": results}
+
+
 app.include_router(api_router)
+app.add_middleware(ContentNegotiationMiddleware)
 app.add_middleware(
     CORSMiddleware, allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
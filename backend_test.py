@@ -149,6 +149,31 @@ class ERWBackendTester:
         )
         if success and isinstance(data, list):
             print(f"   Found {len(data)} summary entries")
+            if not data:
+                print("   ⚠️  No summary statistics (should be regenerated from samples)")
+                return False
+            _, regions = self.run_test(
+                "Regions CDR (summary cross-check)", "GET", "/regions/cdr",
+                params={"feedstock": "calcite", "omega": 5}
+            )
+            region_totals = {r['region']: r['total_cdr'] for r in regions or []}
+            overall = [row for row in data if row['region'] == 'TOTAL / OVERALL']
+            if len(overall) != 1:
+                print("   ⚠️  Expected exactly one TOTAL / OVERALL summary row")
+                return False
+            per_region = [row for row in data if row['region'] != 'TOTAL / OVERALL']
+            if overall[0]['n_samples'] < sum(row['n_samples'] for row in per_region):
+                print("   ⚠️  TOTAL / OVERALL n_samples is smaller than the sum of regions")
+                return False
+            # The overall row also covers samples without a region, so it can only exceed the regional sum
+            if overall[0]['cdr_total'] < sum(row['cdr_total'] for row in per_region) - 1e-6 * max(1, abs(overall[0]['cdr_total'])):
+                print("   ⚠️  TOTAL / OVERALL cdr_total is smaller than the sum of regions")
+                return False
+            for row in data:
+                expected = region_totals.get(row['region'])
+                if expected is not None and abs(expected - row['cdr_total']) > 1e-6 * max(1, abs(expected)):
+                    print(f"   ⚠️  {row['region']}: summary cdr_total {row['cdr_total']} != samples {expected}")
+                    return False
         return success
 
     def test_filters(self):
@@ -164,6 +189,33 @@ class ERWBackendTester:
             print(f"   Available states: {len(states)}")
         return success
 
+    def test_facets(self):
+        """Test cross-filtered facet counts"""
+        success, data = self.run_test(
+            "Filter Facets", "GET", "/filters/facets",
+            params={"feedstock": "calcite", "omega": 5}
+        )
+        if not (success and isinstance(data, dict)):
+            return success
+        facets = data.get('facets', {})
+        for field in ['region', 'state', 'river_name', 'river_type']:
+            print(f"   {field}: {len(facets.get(field, []))} values")
+        regions = facets.get('region', [])
+        if not regions:
+            return success
+        region = regions[0]['value']
+        narrowed_success, narrowed = self.run_test(
+            f"Filter Facets (region={region})", "GET", "/filters/facets",
+            params={"feedstock": "calcite", "omega": 5, "region": region}
+        )
+        if narrowed_success and isinstance(narrowed, dict):
+            state_total = sum(b['count'] for b in narrowed['facets'].get('state', []))
+            print(f"   States in {region}: {len(narrowed['facets'].get('state', []))}")
+            if narrowed['total']['count'] != regions[0]['count'] or state_total > regions[0]['count']:
+                print("   ⚠️  Cross-filtered counts do not match region count")
+                return False
+        return success and narrowed_success
+
     def test_analytics_full(self):
         """Test analytics full data (new endpoint)"""
         success, data = self.run_test(
@@ -210,6 +262,50 @@ class ERWBackendTester:
                 print(f"   Sample NICB data: Basin={sample.get('basin', 'N/A')}, Within 5%={sample.get('pct_within_5', 0)}%")
         return success
 
+    def test_bootstrap_ci(self):
+        """Test bootstrap confidence intervals for regional CDR"""
+        success, data = self.run_test(
+            "Bootstrap CI", "GET", "/analytics/bootstrap-ci",
+            params={"feedstock": "calcite", "omega": 5, "group_by": "region", "n_boot": 2000}
+        )
+        if success and isinstance(data, dict):
+            groups = data.get('groups', [])
+            print(f"   Found {len(groups)} groups with intervals")
+            for g in groups[:3]:
+                t = g['total_cdr']
+                print(f"   - {g['group']} (n={g['count']}): {t['estimate']:.2f} [{t['lower']:.2f}, {t['upper']:.2f}] t/yr")
+                if not t['lower'] <= t['estimate'] <= t['upper']:
+                    print("   ⚠️  Point estimate outside interval")
+                    return False
+        return success
+
+    def test_quality_screening(self):
+        """Test NICB quality screening on aggregation routes"""
+        params = {"feedstock": "calcite", "omega": 5}
+        success, all_data = self.run_test("Overview (all quality)", "GET", "/dashboard/overview", params=params)
+        screened_success, screened = self.run_test(
+            "Overview (quality=within_5)", "GET", "/dashboard/overview", params={**params, "quality": "within_5"}
+        )
+        if success and screened_success:
+            print(f"   Samples: {all_data.get('total_samples')} all, {screened.get('total_samples')} within 5%")
+            if screened.get('total_samples', 0) > all_data.get('total_samples', 0):
+                print("   ⚠️  Screened view has more samples than unscreened")
+                return False
+        map_success, _ = self.run_test(
+            "Map Data (quality=within_10)", "GET", "/samples/map", params={**params, "quality": "within_10"}
+        )
+        bad_success, _ = self.run_test(
+            "Invalid Quality", "GET", "/regions/cdr", expected_status=400, params={**params, "quality": "bogus"}
+        )
+        summary_success, summary = self.run_test(
+            "Summary (quality=within_5)", "GET", "/summary", params={**params, "quality": "within_5"}
+        )
+        if summary_success and isinstance(summary, list):
+            if any(row.get('quality') != 'within_5' for row in summary):
+                print("   ⚠️  Summary rows for another quality level returned")
+                return False
+        return success and screened_success and map_success and bad_success and summary_success
+
     def test_states_cdr(self):
         """Test states CDR data"""
         success, data = self.run_test(
@@ -230,6 +326,126 @@ class ERWBackendTester:
             print(f"   Found {len(data)} map data points")
         return success
 
+    def test_spatial_queries(self):
+        """Test kNN and radius spatial queries"""
+        success, data = self.run_test(
+            "Nearest Samples", "GET", "/samples/nearest",
+            params={"lat": 25.3, "lon": 83.0, "k": 10, "feedstock": "calcite", "omega": 5}
+        )
+        if success and isinstance(data, list):
+            print(f"   Found {len(data)} nearest samples")
+            distances = [d.get('distance_km', 0) for d in data]
+            if distances != sorted(distances):
+                print("   ⚠️  Results are not sorted by distance")
+                return False
+        within_success, within_data = self.run_test(
+            "Samples Within Radius", "GET", "/samples/within",
+            params={"lat": 25.3, "lon": 83.0, "radius_km": 50, "feedstock": "calcite", "omega": 5}
+        )
+        if within_success and isinstance(within_data, list):
+            print(f"   Found {len(within_data)} samples within 50 km")
+            if any(d.get('distance_km', 0) > 50 for d in within_data):
+                print("   ⚠️  Sample outside radius returned")
+                return False
+        bad_success, _ = self.run_test(
+            "Nearest Samples (negative max_km)", "GET", "/samples/nearest", expected_status=400,
+            params={"lat": 25.3, "lon": 83.0, "max_km": -5}
+        )
+        return success and within_success and bad_success
+
+    def test_msgpack_negotiation(self):
+        """Test msgpack content negotiation on a large list route"""
+        url = f"{self.api_url}/samples/map"
+        params = {"feedstock": "calcite", "omega": 5}
+        self.tests_run += 1
+        print("\n🔍 Testing Map Data (msgpack)...")
+        json_resp = requests.get(url, params=params, timeout=10)
+        packed_resp = requests.get(url, params=params, headers={"Accept": "application/msgpack"}, timeout=10)
+        content_type = packed_resp.headers.get("content-type", "")
+        print(f"   JSON: {len(json_resp.content)} bytes, msgpack: {len(packed_resp.content)} bytes ({content_type})")
+        error = None
+        if packed_resp.status_code != 200 or not content_type.startswith("application/msgpack"):
+            error = f"status {packed_resp.status_code}, content-type {content_type}"
+        else:
+            import msgpack
+            if msgpack.unpackb(packed_resp.content, raw=False) != json_resp.json():
+                error = "decoded msgpack body differs from the JSON body"
+        if error is None:
+            self.tests_passed += 1
+            print("✅ Passed")
+            return True
+        print(f"❌ Failed - {error}")
+        self.failures.append({"test": "Map Data (msgpack)", "endpoint": "/samples/map", "error": error})
+        return False
+
+    def test_export(self):
+        """Test streaming CSV / NDJSON export"""
+        success, data = self.run_test(
+            "Export CSV", "GET", "/export",
+            params={"format": "csv", "feedstock": "calcite", "omega": 5, "fields": "sample_no,region,cdr_t_yr"}
+        )
+        if success and isinstance(data, str):
+            lines = data.strip().splitlines()
+            print(f"   Exported {len(lines) - 1} rows, header: {lines[0] if lines else ''}")
+        ndjson_success, _ = self.run_test(
+            "Export NDJSON", "GET", "/export",
+            params={"format": "ndjson", "feedstock": "calcite", "omega": 5, "region": "Ganga"}
+        )
+        bad_success, _ = self.run_test(
+            "Export Unknown Field", "GET", "/export", expected_status=400,
+            params={"format": "csv", "fields": "not_a_field"}
+        )
+        return success and ndjson_success and bad_success
+
+    def test_batch(self):
+        """Test batched multi-request endpoint with per-item error isolation"""
+        params = {"feedstock": "calcite", "omega": 5}
+        success, data = self.run_test(
+            "Batch", "POST", "/batch",
+            data={"requests": [
+                {"route": "/dashboard/overview", "params": params},
+                {"route": "/regions/cdr", "params": params},
+                {"route": "/rivers/top", "params": {**params, "limit": "5"}},
+                {"route": "/does/not/exist"},
+                {"route": "/rivers/top?limit=1", "params": {"feedstock": "calcite", "omega": 5}},
+            ]}
+        )
+        if success and isinstance(data, dict):
+            statuses = [r.get('status') for r in data.get('results', [])]
+            print(f"   Item statuses: {statuses}")
+            if statuses != [200, 200, 200, 404, 200]:
+                print("   ⚠️  Unexpected batch item statuses")
+                return False
+            if len(data['results'][2]['data']) > 5:
+                print("   ⚠️  String param was not coerced to int")
+                return False
+            if len(data['results'][4]['data']) > 1:
+                print("   ⚠️  Query-string param in route was ignored")
+                return False
+        return success
+
+    def test_single_flight(self):
+        """Test that concurrent identical aggregations are coalesced"""
+        from concurrent.futures import ThreadPoolExecutor
+        before_success, before = self.run_test("Single-flight Metrics (before)", "GET", "/system/single-flight")
+        url = f"{self.api_url}/analytics/basin-stats"
+        params = {"feedstock": "calcite", "omega": 5}
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            statuses = list(pool.map(lambda _: requests.get(url, params=params, timeout=30).status_code, range(20)))
+        print(f"   Concurrent statuses: {statuses}")
+        after_success, after = self.run_test("Single-flight Metrics (after)", "GET", "/system/single-flight")
+        if not (before_success and after_success and all(code == 200 for code in statuses)):
+            return False
+        coalesced = after.get('coalesced', 0) - before.get('coalesced', 0)
+        leaders = after.get('leaders', 0) - before.get('leaders', 0)
+        print(f"   Burst of 20: {leaders} leader(s), {coalesced} coalesced waiter(s)")
+        if coalesced <= 0:
+            print("   ⚠️  No concurrent requests were coalesced")
+            self.failures.append({"test": "Single-flight coalescing", "endpoint": "/analytics/basin-stats",
+                                  "error": f"coalesced did not increase ({leaders} leaders)"})
+            return False
+        return True
+
     def test_chat_functionality(self):
         """Test AI chat functionality"""
         # Test chat endpoint
@@ -267,11 +483,19 @@ def main():
         tester.test_top_rivers,
         tester.test_summary,
         tester.test_filters,
+        tester.test_facets,
         tester.test_analytics_full,
         tester.test_analytics_basin_stats,
         tester.test_analytics_nicb_quality,
+        tester.test_bootstrap_ci,
+        tester.test_quality_screening,
         tester.test_states_cdr,
         tester.test_map_data,
+        tester.test_spatial_queries,
+        tester.test_msgpack_negotiation,
+        tester.test_export,
+        tester.test_batch,
+        tester.test_single_flight,
         tester.test_chat_functionality,
     ]
     
@@ -20,14 +20,31 @@ export const fetchSamples = (fs = "calcite", o = 5, region, state, limit = 200)
 };
 export const fetchMapData = (fs = "calcite", o = 5) =>
   api.get(`/samples/map?feedstock=${fs}&omega=${o}`).then(r => r.data);
+export const fetchNearestSamples = (lat, lon, k = 10, fs = "calcite", o = 5) =>
+  api.get(`/samples/nearest?lat=${lat}&lon=${lon}&k=${k}&feedstock=${fs}&omega=${o}`).then(r => r.data);
+export const fetchSamplesWithin = (lat, lon, radiusKm = 50, fs = "calcite", o = 5) =>
+  api.get(`/samples/within?lat=${lat}&lon=${lon}&radius_km=${radiusKm}&feedstock=${fs}&omega=${o}`).then(r => r.data);
 export const fetchFilters = (fs = "calcite", o = 5) =>
   api.get(`/filters?feedstock=${fs}&omega=${o}`).then(r => r.data);
+export const fetchFacets = (fs = "calcite", o = 5, selection = {}) => {
+  let url = `/filters/facets?feedstock=${fs}&omega=${o}`;
+  Object.entries(selection).forEach(([k, v]) => { if (v) url += `&${k}=${encodeURIComponent(v)}`; });
+  return api.get(url).then(r => r.data);
+};
 export const fetchAnalyticsFull = (fs = "calcite", o = 5) =>
   api.get(`/analytics/full?feedstock=${fs}&omega=${o}`).then(r => r.data);
 export const fetchBasinStats = (fs = "calcite", o = 5) =>
   api.get(`/analytics/basin-stats?feedstock=${fs}&omega=${o}`).then(r => r.data);
 export const fetchNicbQuality = (fs = "calcite", o = 5) =>
   api.get(`/analytics/nicb-quality?feedstock=${fs}&omega=${o}`).then(r => r.data);
+export const exportSamplesUrl = (format = "csv", fs = "calcite", o = 5, region, state) => {
+  let url = `${API}/export?format=${format}&feedstock=${fs}&omega=${o}`;
+  if (region) url += `&region=${encodeURIComponent(region)}`;
+  if (state) url += `&state=${encodeURIComponent(state)}`;
+  return url;
+};
+export const fetchBootstrapCi = (fs = "calcite", o = 5, groupBy = "region", nBoot = 2000) =>
+  api.get(`/analytics/bootstrap-ci?feedstock=${fs}&omega=${o}&group_by=${groupBy}&n_boot=${nBoot}`).then(r => r.data);
 export const fetchFeedstocks = () =>
   api.get("/feedstocks").then(r => r.data);
 export const uploadFeedstock = (file, name, omega) => {
@@ -39,6 +56,8 @@ export const uploadFeedstock = (file, name, omega) => {
 };
 export const fetchComparison = (fs = "calcite") =>
   api.get(`/comparison?feedstock=${fs}`).then(r => r.data);
+export const fetchBatch = (requests) =>
+  api.post("/batch", { requests }).then(r => r.data.results);
 export const sendChatMessage = (msg, sid = "default") =>
   api.post("/chat", { message: msg, session_id: sid }).then(r => r.data);
 export const fetchChatHistory = (sid = "default") =>